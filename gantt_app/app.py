@@ -38,16 +38,21 @@ New in this version:
 """
 from __future__ import annotations
 
+import hashlib
 import os
 import sys
+import threading
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from flask import Flask, request, redirect, url_for, render_template, abort
 from flask_sqlalchemy import SQLAlchemy
 from jinja2 import DictLoader
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
 
 # ------------------------------
 # Helpers: safe SQLite URI for cloud hosts
@@ -97,22 +102,53 @@ def _prepare_sqlite_uri(raw: str) -> str:
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-gantt')
 raw_db = os.environ.get('DATABASE_URL', 'sqlite:///gantt_demo.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = _prepare_sqlite_uri(raw_db)
+# `python3 app.py` (no --serve) only runs run_self_tests(): keep it off the real DB file
+# and on one shared in-memory connection (nothing to create, seed or clean up on disk)
+_SELF_TEST = __name__ == '__main__' and '--serve' not in sys.argv[1:]
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://' if _SELF_TEST else _prepare_sqlite_uri(raw_db)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Ensure a fresh session is created on demand across requests
 # (identity map staleness can otherwise show old titles after edits)
 app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+if _SELF_TEST:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['poolclass'] = StaticPool
 if str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
     app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('connect_args', {
         'check_same_thread': False,
         'timeout': 30,
     })
+# Keep a real pool per gthread worker instead of reopening the DB file per checkout
+# (in-memory SQLite gets a StaticPool from Flask-SQLAlchemy, which takes no sizing).
+_engine_opts = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+if app.config['SQLALCHEMY_DATABASE_URI'] not in ('sqlite://', 'sqlite:///:memory:'):
+    _engine_opts.setdefault('pool_size', 5)
+    _engine_opts.setdefault('max_overflow', 10)
+if not str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
+    # networked DBs: drop connections the server closed while idle
+    _engine_opts.setdefault('pool_pre_ping', True)
+    _engine_opts.setdefault('pool_recycle', 1800)
 
 db = SQLAlchemy(app)
 
+
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    """WAL: the Gantt read doesn't block on an assignment write (1 writer + N readers)."""
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    cur.execute('PRAGMA mmap_size=268435456')
+    cur.close()
+
+if str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
+    with app.app_context():
+        event.listen(db.engine, 'connect', _sqlite_pragmas)
+
 # Ensure fresh content for every response (avoid proxy/browser cache)
 @app.after_request
 def _no_cache(resp):
+    if request.endpoint == 'asset':
+        return resp  # versioned static assets set their own long-lived caching
     resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     resp.headers['Pragma'] = 'no-cache'
     return resp
@@ -133,7 +169,16 @@ class Assign(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     memo = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False)
+
+    __table_args__ = (
+        # routes swap reversed dates before writing; the schema enforces it for every other path
+        db.CheckConstraint('start_date <= end_date', name='ck_assign_date_order'),
+        # per-lane lookups by staff over a date range
+        db.Index('ix_assign_staff_dates', 'staff_id', 'start_date', 'end_date'),
+        # the Gantt window filter: end_date >= :start AND start_date <= :end
+        db.Index('ix_assign_end_start', 'end_date', 'start_date'),
+    )
 
 # ------------------------------
 # Bootstrapping
@@ -151,46 +196,160 @@ SEED_STAFF = [
     ('JSP',  '#43aa8b'),
 ]
 
+# every route calls ensure_db_seed(); after the first success it is a flag check
+_SEEDED = False
+_SEED_LOCK = threading.Lock()
+
+
 def ensure_db_seed() -> None:
     """Create tables and seed staff names.
     Safe to call from anywhere (opens its own app context).
+    Runs once per process; concurrent first requests wait on a lock.
     """
+    global _SEEDED
+    if _SEEDED:
+        return
+    with _SEED_LOCK:
+        if _SEEDED:
+            return
+        _seed_db()
+        _SEEDED = True
+
+
+def _seed_db() -> None:
     with app.app_context():
         db.create_all()
-        if Staff.query.count() == 0:
-            for n, c in SEED_STAFF:
-                db.session.add(Staff(name=n, color=c))
+        # create_all() skips existing tables; add indexes declared after they were created
+        for idx in Assign.__table__.indexes:
+            idx.create(db.engine, checkfirst=True)
+        # existence probe stops at the first row; seeding is one executemany INSERT
+        if db.session.query(Staff.id).first() is None:
+            db.session.execute(Staff.__table__.insert(),
+                               [{'name': n, 'color': c} for n, c in SEED_STAFF])
             db.session.commit()
+            _invalidate_staff_cache()
+
+
+@dataclass(frozen=True)
+class StaffRow:
+    id: int
+    name: str
+    color: str | None
+
+
+# Staff only changes when ensure_db_seed() seeds it, so the ordered list is read once
+# per process; bump the version to force a re-read.
+_STAFF_VERSION = 0
+
+
+def _invalidate_staff_cache() -> None:
+    global _STAFF_VERSION
+    _STAFF_VERSION += 1
+
+
+@lru_cache(maxsize=1)
+def _staff_rows(version: int) -> Tuple[StaffRow, ...]:
+    rows = db.session.execute(
+        db.select(Staff.id, Staff.name, Staff.color).order_by(Staff.name.asc())
+    ).mappings()
+    return tuple(StaffRow(**r) for r in rows)
+
+
+def staff_rows() -> Tuple[StaffRow, ...]:
+    return _staff_rows(_STAFF_VERSION)
+
+def bulk_create_assigns(rows: List[dict]) -> int:
+    """Insert many assignments in one executemany INSERT (no ORM objects).
+    Each row: title, staff_id, start, end, memo (optional). Reversed dates are swapped.
+    """
+    payload = []
+    for r in rows:
+        s, e = sorted((r['start'], r['end']))
+        payload.append({'title': r['title'], 'staff_id': r['staff_id'],
+                        'start_date': s, 'end_date': e, 'memo': r.get('memo', '')})
+    if payload:
+        db.session.execute(Assign.__table__.insert(), payload)
+        db.session.commit()
+    return len(payload)
 
 # ------------------------------
 # Date helpers
 # ------------------------------
-@dataclass
+_WD = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+@dataclass(frozen=True)
 class Timeline:
+    # immutable: cached instances are shared across requests/threads
     start: date
     end: date
-    days: List[date]
+    n_days: int
+    headers: Tuple[Tuple[str, str], ...]  # ('MM/DD', weekday) per header cell
 
 
 def parse_date(s: str) -> date:
-    return datetime.strptime(s, '%Y-%m-%d').date()
+    # date.fromisoformat is the C fast path for YYYY-MM-DD; strptime only for looser input
+    try:
+        return date.fromisoformat(s)
+    except ValueError:
+        return datetime.strptime(s, '%Y-%m-%d').date()
 
 
+@lru_cache(maxsize=512)
 def monday_of(d: date) -> date:
     return d - timedelta(days=d.weekday())
 
 
-def build_timeline(start: date | None = None, weeks: int = 4) -> Timeline:
-    start = monday_of(start or date.today())
+@lru_cache(maxsize=64)
+def _build_timeline_cached(start_iso: str, weeks: int) -> Timeline:
+    start = date.fromisoformat(start_iso)
     total_days = weeks * 7
-    days = [start + timedelta(days=i) for i in range(total_days)]
-    end = days[-1]
-    return Timeline(start=start, end=end, days=days)
+    end = start + timedelta(days=total_days - 1)
+    # the header row is the only per-day consumer; no separate list of date objects is kept
+    headers = tuple((d.strftime('%m/%d'), _WD[d.weekday()])
+                    for d in (start + timedelta(days=i) for i in range(total_days)))
+    return Timeline(start=start, end=end, n_days=total_days, headers=headers)
+
+
+def build_timeline(start: date | None = None, weeks: int = 4) -> Timeline:
+    # only a handful of (monday, weeks) pairs are ever live, so reuse the built timeline
+    return _build_timeline_cached(monday_of(start or date.today()).isoformat(), weeks)
 
 
 def overlap(a1: date, a2: date, b1: date, b2: date) -> bool:
     return not (a2 < b1 or b2 < a1)
 
+# ------------------------------
+# Static assets (served from memory, cached by the browser)
+# ------------------------------
+# BASE used to inline these on every page; as separate immutable responses they are
+# fetched once per version and Jinja no longer re-emits them on each render.
+_ASSETS = {
+    'gantt.css': ('text/css', '''
+body { padding-top: 2rem; }
+.grid { display: grid; gap: 6px; }
+.daycell { font-size: .8rem; text-align: center; color: #666; }
+.lane { display: grid; gap: 4px; }
+.bar {
+  border-radius: .5rem; padding: 4px 8px; font-size: .85rem; line-height: 1.2; color:#111;
+  background: #d0e6ff; border: 1px solid rgba(0,0,0,.08);
+  overflow: hidden; text-overflow: ellipsis; white-space: nowrap;
+  text-decoration: none; display: block;
+}
+.bar:hover { filter: brightness(0.95); }
+.memo { font-size: .75rem; opacity: .8; }
+.sticky-header { position: sticky; top: 0; background: #fff; z-index: 2; }
+.label { font-weight: 600; }
+.date-col { min-width: 40px; }
+'''.lstrip().encode()),
+    'gantt.js': ('application/javascript', '''
+// enable tooltips if present
+const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'))
+tooltipTriggerList.map(function (el) { return new bootstrap.Tooltip(el) })
+'''.lstrip().encode()),
+}
+ASSET_VER = hashlib.sha1(b''.join(body for _, body in _ASSETS.values())).hexdigest()[:10]
+
 # ------------------------------
 # Templates (inline via DictLoader)
 # ------------------------------
@@ -201,34 +360,14 @@ BASE = """
   <meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
   <title>Gantt App</title>
   <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
-  <style>
-    body { padding-top: 2rem; }
-    .grid { display: grid; gap: 6px; }
-    .daycell { font-size: .8rem; text-align: center; color: #666; }
-    .lane { display: grid; gap: 4px; }
-    .bar {
-      border-radius: .5rem; padding: 4px 8px; font-size: .85rem; line-height: 1.2; color:#111;
-      background: #d0e6ff; border: 1px solid rgba(0,0,0,.08);
-      overflow: hidden; text-overflow: ellipsis; white-space: nowrap;
-      text-decoration: none; display: block;
-    }
-    .bar:hover { filter: brightness(0.95); }
-    .memo { font-size: .75rem; opacity: .8; }
-    .sticky-header { position: sticky; top: 0; background: #fff; z-index: 2; }
-    .label { font-weight: 600; }
-    .date-col { min-width: 40px; }
-  </style>
+  <link href="{{ url_for('asset', name='gantt.css', v=ASSET_VER) }}" rel="stylesheet">
 </head>
 <body>
 <div class="container">
   {% block body %}{% endblock %}
 </div>
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js"></script>
-<script>
-  // enable tooltips if present
-  const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'))
-  tooltipTriggerList.map(function (el) { return new bootstrap.Tooltip(el) })
-</script>
+<script src="{{ url_for('asset', name='gantt.js', v=ASSET_VER) }}"></script>
 </body>
 </html>
 """
@@ -250,26 +389,20 @@ GANTT = """
   </form>
 </div>
 
-<div class="grid" style="grid-template-columns: 180px repeat({{ tl.days|length }}, minmax(40px, 1fr)); align-items: start;">
+<div class="grid" style="grid-template-columns: 180px repeat({{ tl.n_days }}, minmax(40px, 1fr)); align-items: start;">
   <!-- Header row -->
   <div class="sticky-header"></div>
-  {% for d in tl.days %}
-    <div class="daycell sticky-header date-col">{{ d.strftime('%m/%d') }}<br><span class="text-muted">{{ ['Mon','Tue','Wed','Thu','Fri','Sat','Sun'][d.weekday()] }}</span></div>
+  {% for md, wd in tl.headers %}
+    <div class="daycell sticky-header date-col">{{ md }}<br><span class="text-muted">{{ wd }}</span></div>
   {% endfor %}
 
   <!-- Lanes per staff -->
   {% for s in staff_list %}
     <div class="label pt-2">{{ s.name }}</div>
-    <div class="lane" style="grid-column: 2 / span {{ tl.days|length }}; grid-template-columns: repeat({{ tl.days|length }}, 1fr);">
-      {% for it in grouped.get(s.id, []) %}
-        {% set start = (it.start_date - tl.start).days + 1 %}
-        {% set span  = (it.end_date - it.start_date).days + 1 %}
-        {% if start < 1 %}{% set start = 1 %}{% endif %}
-        {% if start > tl.days|length %}{% set start = tl.days|length %}{% endif %}
-        {% set maxspan = tl.days|length - start + 1 %}
-        {% if span > maxspan %}{% set span = maxspan %}{% endif %}
-        <a class="bar" href="{{ url_for('edit_assign', assign_id=it.id, start=tl.start, weeks=weeks) }}" style="grid-column: {{ start }} / span {{ span }}; background: {{ s.color or '#d0e6ff' }};" data-bs-toggle="tooltip" title="{{ it.memo or '' }}">
-          <strong>{{ it.title }}</strong>
+    <div class="lane" style="grid-column: 2 / span {{ tl.n_days }}; grid-template-columns: repeat({{ tl.n_days }}, 1fr);">
+      {% for aid, title, col, span, memo, color in lanes[loop.index0] %}
+        <a class="bar" href="{{ url_for('edit_assign', assign_id=aid, start=tl.start, weeks=weeks) }}" style="grid-column: {{ col }} / span {{ span }}; background: {{ color }};" data-bs-toggle="tooltip" title="{{ memo }}">
+          <strong>{{ title }}</strong>
         </a>
       {% else %}
         <div class="text-muted" style="grid-column: 1 / -1; font-size:.85rem;">—</div>
@@ -361,8 +494,20 @@ EDIT = """
 {% endblock %}
 """
 
-# Register templates into Flask/Jinja so `{% extends 'BASE' %}` works even without files
-app.jinja_loader = DictLoader({'BASE': BASE, 'GANTT': GANTT, 'FORM': FORM, 'EDIT': EDIT})
+# Register templates into Flask/Jinja so `{% extends 'BASE' %}` works even without files.
+# They are module constants: no reload checks, and compiled templates are never evicted.
+# trim/lstrip: block tags don't emit their own indentation + newline on every loop pass
+app.jinja_options = {**app.jinja_options, 'auto_reload': False, 'cache_size': -1,
+                     'trim_blocks': True, 'lstrip_blocks': True}
+app.jinja_loader = DictLoader({k: v.strip() for k, v in
+                               {'BASE': BASE, 'GANTT': GANTT, 'FORM': FORM, 'EDIT': EDIT}.items()})
+
+app.jinja_env.globals['ASSET_VER'] = ASSET_VER
+
+# Compile once at import; /gantt renders its Template object directly.
+for _name in ('BASE', 'FORM', 'EDIT'):
+    app.jinja_env.get_template(_name)
+_GANTT_TPL = app.jinja_env.get_template('GANTT')
 
 # ------------------------------
 # Routes
@@ -384,33 +529,44 @@ def gantt():
     start = parse_date(qs_start) if qs_start else monday_of(date.today())
     tl = build_timeline(start, weeks)
 
-    # fetch staff & overlapping assignments (fresh session will reflect latest DB state)
-    staff_list = Staff.query.order_by(Staff.name.asc()).all()
-    grouped: Dict[int, List[dict]] = {s.id: [] for s in staff_list}
-
-    q = Assign.query.filter(Assign.end_date >= tl.start, Assign.start_date <= tl.end)
-    q = q.order_by(Assign.start_date.asc(), Assign.id.asc())
-    items = q.all()
-
-    # bucket by staff and clamp to window for rendering (without mutating DB rows)
-    for it in items:
-        if it.staff_id in grouped:
-            start_clamped = max(it.start_date, tl.start)
-            end_clamped = min(it.end_date, tl.end)
-            grouped[it.staff_id].append({
-                'id': it.id,
-                'title': it.title,
-                'start_date': start_clamped,
-                'end_date': end_clamped,
-                'memo': it.memo or '',
-            })
-
-    return render_template('GANTT', tl=tl, staff_list=staff_list, grouped=grouped, weeks=weeks)
+    # lanes come from the cached staff list; one round trip for the assignments
+    # overlapping the window (fresh session will reflect latest DB state)
+    staff = staff_rows()
+    # plain column mappings: no ORM identity map / instance construction per bar
+    rows = db.session.execute(
+        db.select(Assign.id, Assign.staff_id, Assign.title, Assign.start_date,
+                  Assign.end_date, Assign.memo)
+        .where(Assign.end_date >= tl.start, Assign.start_date <= tl.end)
+        .order_by(Assign.start_date.asc(), Assign.id.asc())
+    ).mappings().all()
+
+    # bucket by staff and clamp to the window as ready-to-render grid offsets
+    # (without mutating DB rows); the template only loops lanes and interpolates col/span
+    total = tl.n_days
+    # lanes[i] holds staff[i]'s bars as (id, title, col, span, memo, color) tuples
+    pos = {s.id: i for i, s in enumerate(staff)}
+    colors = [s.color or '#d0e6ff' for s in staff]
+    lanes: List[List[tuple]] = [[] for _ in staff]
+    for it in rows:
+        p = pos.get(it['staff_id'])
+        if p is None:
+            continue
+        # clamp to the window with plain comparisons (no min()/max() call per bar);
+        # most bars fit, so both conditions are usually false
+        first = (it['start_date'] - tl.start).days
+        if first < 0:
+            first = 0
+        last = (it['end_date'] - tl.start).days
+        if last >= total:
+            last = total - 1
+        lanes[p].append((it['id'], it['title'], first + 1, last - first + 1,
+                         it['memo'] or '', colors[p]))
+
+    return _GANTT_TPL.render(tl=tl, staff_list=staff, lanes=lanes, weeks=weeks)
 
 @app.route('/assign/new', methods=['GET','POST'])
 def new_assign():
     ensure_db_seed()
-    staff_list = Staff.query.order_by(Staff.name.asc()).all()
     if request.method == 'POST':
         title = request.form['title']
         staff_id = int(request.form['staff_id'])
@@ -422,15 +578,14 @@ def new_assign():
         db.session.add(Assign(title=title, staff_id=staff_id, start_date=start, end_date=end, memo=memo))
         db.session.commit()
         return redirect(url_for('gantt', start=request.args.get('start'), weeks=request.args.get('weeks')))
-    return render_template('FORM', staff_list=staff_list)
+    return render_template('FORM', staff_list=staff_rows())
 
 @app.route('/assign/<int:assign_id>/edit', methods=['GET','POST'])
 def edit_assign(assign_id: int):
     ensure_db_seed()
-    rec = Assign.query.get(assign_id)
+    rec = db.session.get(Assign, assign_id)
     if not rec:
         return abort(404)
-    staff_list = Staff.query.order_by(Staff.name.asc()).all()
     if request.method == 'POST':
         rec.title = request.form['title']
         rec.staff_id = int(request.form['staff_id'])
@@ -444,12 +599,12 @@ def edit_assign(assign_id: int):
         # Drop the current session to ensure next render re-queries fresh state
         db.session.remove()
         return redirect(url_for('gantt', start=request.args.get('start'), weeks=request.args.get('weeks')))
-    return render_template('EDIT', rec=rec, staff_list=staff_list)
+    return render_template('EDIT', rec=rec, staff_list=staff_rows())
 
 @app.route('/assign/<int:assign_id>/delete', methods=['POST'])
 def delete_assign(assign_id: int):
     ensure_db_seed()
-    rec = Assign.query.get(assign_id)
+    rec = db.session.get(Assign, assign_id)
     if not rec:
         return abort(404)
     db.session.delete(rec)
@@ -458,6 +613,18 @@ def delete_assign(assign_id: int):
     db.session.remove()
     return redirect(url_for('gantt', start=request.args.get('start'), weeks=request.args.get('weeks')))
 
+@app.route('/assets/<name>')
+def asset(name: str):
+    entry = _ASSETS.get(name)
+    if entry is None:
+        return abort(404)
+    mimetype, body = entry
+    resp = app.response_class(body, mimetype=mimetype)
+    # URLs carry ?v=ASSET_VER, so a changed asset is a new URL
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resp.set_etag(ASSET_VER)
+    return resp.make_conditional(request)
+
 @app.route('/health')
 def health():
     return 'ok', 200
@@ -482,19 +649,20 @@ def run_self_tests() -> None:
             assert r.status_code == 200 and b'Gantt-like' in r.data, 'gantt view failed'
 
             # 3) create an assignment and see it on gantt
-            first_staff = Staff.query.order_by(Staff.id.asc()).first()
-            assert first_staff is not None, 'seed staff missing'
+            # keep plain ids: each request drops the scoped session, detaching ORM rows
+            staff_id = db.session.query(Staff.id).order_by(Staff.id.asc()).limit(1).scalar()
+            assert staff_id is not None, 'seed staff missing'
             today = date.today()
             payload = {
                 'title': 'Unit Test Task',
-                'staff_id': str(first_staff.id),
+                'staff_id': str(staff_id),
                 'start': today.strftime('%Y-%m-%d'),
                 'end':   (today + timedelta(days=3)).strftime('%Y-%m-%d'),
                 'memo':  'added by self-test',
             }
             r = c.post('/assign/new?weeks=2', data=payload, follow_redirects=True)
             assert r.status_code == 200, 'POST /assign/new did not redirect correctly'
-            created = Assign.query.filter_by(title='Unit Test Task', staff_id=first_staff.id).first()
+            created = Assign.query.filter_by(title='Unit Test Task', staff_id=staff_id).first()
             assert created is not None, 'assignment not persisted'
             # Check it renders back
             r = c.get('/gantt?weeks=2')
@@ -503,53 +671,53 @@ def run_self_tests() -> None:
             # 4) reversed dates should be auto-swapped
             payload2 = {
                 'title': 'Swap Dates',
-                'staff_id': str(first_staff.id),
+                'staff_id': str(staff_id),
                 'start': (today + timedelta(days=5)).strftime('%Y-%m-%d'),
                 'end':   (today + timedelta(days=2)).strftime('%Y-%m-%d'),
                 'memo':  'reversed dates',
             }
             r = c.post('/assign/new?weeks=2', data=payload2, follow_redirects=True)
             assert r.status_code == 200
-            rec = Assign.query.filter_by(title='Swap Dates', staff_id=first_staff.id).first()
+            rec = Assign.query.filter_by(title='Swap Dates', staff_id=staff_id).first()
             assert rec and rec.start_date <= rec.end_date, 'date swap normalization failed'
 
             # 5) long-span task should not mutate stored dates when rendering
             long_title = 'Very Long Task'
             long_start = today - timedelta(days=30)
             long_end   = today + timedelta(days=30)
-            db.session.add(Assign(title=long_title, staff_id=first_staff.id, start_date=long_start, end_date=long_end, memo='long'))
+            db.session.add(Assign(title=long_title, staff_id=staff_id, start_date=long_start, end_date=long_end, memo='long'))
             db.session.commit()
             # Render a short window
             r = c.get('/gantt?weeks=2')
             assert r.status_code == 200 and long_title.encode() in r.data
             # Verify DB still has original dates
-            rec2 = Assign.query.filter_by(title=long_title, staff_id=first_staff.id).first()
+            rec2 = Assign.query.filter_by(title=long_title, staff_id=staff_id).first()
             assert rec2 and rec2.start_date == long_start and rec2.end_date == long_end, 'rendering mutated DB row!'
 
             # 6) EDIT: change title + memo via edit endpoint
-            to_edit = Assign.query.filter_by(title='Unit Test Task', staff_id=first_staff.id).first()
-            assert to_edit is not None
+            edit_id = db.session.query(Assign.id).filter_by(title='Unit Test Task', staff_id=staff_id).limit(1).scalar()
+            assert edit_id is not None
             edit_payload = {
                 'title': 'Edited Task',
-                'staff_id': str(first_staff.id),
+                'staff_id': str(staff_id),
                 'start': today.strftime('%Y-%m-%d'),
                 'end':   (today + timedelta(days=3)).strftime('%Y-%m-%d'),
                 'memo':  'edited memo',
             }
-            r = c.post(f'/assign/{to_edit.id}/edit?weeks=2', data=edit_payload, follow_redirects=True)
+            r = c.post(f'/assign/{edit_id}/edit?weeks=2', data=edit_payload, follow_redirects=True)
             assert r.status_code == 200
-            edited = Assign.query.get(to_edit.id)
+            edited = db.session.get(Assign, edit_id)
             assert edited.title == 'Edited Task' and edited.memo == 'edited memo', 'edit did not persist'
             # Fresh fetch should not include the old title
             r = c.get('/gantt?weeks=2')
             assert b'Edited Task' in r.data and b'Unit Test Task' not in r.data, 'gantt not reflecting edit'
 
             # 7) DELETE: remove the 'Swap Dates' record
-            to_del = Assign.query.filter_by(title='Swap Dates', staff_id=first_staff.id).first()
-            assert to_del is not None
-            r = c.post(f'/assign/{to_del.id}/delete?weeks=2', follow_redirects=True)
+            del_id = db.session.query(Assign.id).filter_by(title='Swap Dates', staff_id=staff_id).limit(1).scalar()
+            assert del_id is not None
+            r = c.post(f'/assign/{del_id}/delete?weeks=2', follow_redirects=True)
             assert r.status_code == 200
-            gone = Assign.query.get(to_del.id)
+            gone = db.session.get(Assign, del_id)
             assert gone is None, 'delete did not remove record'
 
     # 8) BONUS test: ensure ensure_db_seed() can be called without an active app context
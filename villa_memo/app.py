@@ -7,6 +7,10 @@ Villa Staff Memo — Flask single‑file demo (Render‑friendly)
     admin@villa.local / 10051005+   (role=admin,  name=admin)
     stanley@villa.local / 0585      (role=staff,  name=Stanley)
 - Optional access gate: set ACCESS_CODE in env → visit /access
+- Behind nginx: set USE_XACCEL=1 to serve /uploads/ via X-Accel-Redirect
+- Optional: MAX_UPLOAD_MB=16 → reject larger requests with 413 (unset: no limit)
+- Optional: pip install orjson → faster session-cookie / JSON encoding
+- Optional: pip install blake3 → faster photo hashing (else stdlib blake2b)
 - Self‑test page: /selftest (no login needed)
 - 24 villa shortcuts on dashboard; override names via env VILLA_NAMES (comma/newline)
 """
@@ -16,14 +20,19 @@ import os
 import hmac
 import hashlib
 import secrets
+import sys
+import tempfile
+import threading
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Callable
+from typing import Dict, List, Optional, Callable, Tuple
+from urllib.parse import urlencode
 
 from flask import (
-    Flask, request, redirect, url_for, flash, send_from_directory,
-    abort, g
+    Flask, Request, request, redirect, url_for, flash, send_from_directory,
+    abort, g, has_request_context
 )
 from flask import render_template
 from flask_sqlalchemy import SQLAlchemy
@@ -34,6 +43,10 @@ from flask_login import (
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from jinja2 import DictLoader
+from markupsafe import Markup
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, raiseload
 
 # --- Optional dotenv (also loads Render Secret Files at /etc/secrets/.env) ---
 try:
@@ -44,6 +57,18 @@ try:
 except Exception:
     pass
 
+# --- Optional orjson (C JSON codec for the session cookie / jsonify) ---
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- Optional blake3 (SIMD hash for content-addressed photo names) ---
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
 # ------------------------------
 # App & Config
 # ------------------------------
@@ -103,17 +128,43 @@ def _prepare_sqlite_uri(raw: str) -> str:
             pass
         return 'sqlite:////' + str(pf).lstrip('/')
 
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson for dumps/loads; types it can't encode fall back to Flask's default()."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-change-me')
+# PBKDF2 rounds for new hashes (existing hashes keep the count they were made with)
+PW_ITERS = int(os.environ.get('PW_ITERS', '200000'))
 
 # ensure upload dir early (independent from DB path)
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', '/tmp/uploads')
-Path(app.config['UPLOAD_FOLDER']).mkdir(parents=True, exist_ok=True)
+UPLOAD_DIR = Path(app.config['UPLOAD_FOLDER'])
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# in-flight photo uploads: same filesystem (os.replace stays atomic), not under /uploads/
+SPOOL_DIR = UPLOAD_DIR / '.spool'
+SPOOL_DIR.mkdir(exist_ok=True)
+# opt-in request size cap (oversized uploads get 413); unset means no limit, as before
+if os.environ.get('MAX_UPLOAD_MB'):
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ['MAX_UPLOAD_MB']) * 1024 * 1024
+# behind nginx: hand /uploads/ off via X-Accel-Redirect (internal /protected-uploads/ location)
+app.config['USE_XACCEL'] = os.environ.get('USE_XACCEL', '0') == '1'
+# optional shared access code (read once; the gate checks it on every request)
+ACCESS_CODE = os.environ.get('ACCESS_CODE')
 
 # Build a *safe* SQLite URI
 raw_db = os.environ.get('DATABASE_URL', 'sqlite:///memo_demo.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = _prepare_sqlite_uri(raw_db)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# no per-statement timing capture (get_recorded_queries) in production
+app.config['SQLALCHEMY_RECORD_QUERIES'] = False
 
 # SQLite engine options for WSGI servers
 if str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
@@ -123,8 +174,38 @@ if str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
         'timeout': 30,
     })
 
+# Reuse pooled connections across gthread workers instead of reopening the DB per checkout
+# (in-memory SQLite gets a StaticPool from Flask-SQLAlchemy, which takes no sizing).
+_engine_opts = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+# larger compiled-statement cache: the app's queries are few but re-run on every request
+_engine_opts.setdefault('query_cache_size', 1200)
+if app.config['SQLALCHEMY_DATABASE_URI'] != 'sqlite://':
+    # villa_memo/Procfile runs 4 threads/worker, so 5+10 covers it; raise via env for more threads
+    _engine_opts.setdefault('pool_size', int(os.environ.get('DB_POOL_SIZE', '5')))
+    _engine_opts.setdefault('max_overflow', int(os.environ.get('DB_MAX_OVERFLOW', '10')))
+if not str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
+    # networked DBs: drop connections the server closed while idle
+    _engine_opts.setdefault('pool_pre_ping', True)
+    _engine_opts.setdefault('pool_recycle', 1800)
+
 # Create DB handle
 db = SQLAlchemy(app)
+
+
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    """WAL lets list/dashboard reads proceed while a task/check insert is writing."""
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA mmap_size=268435456')
+    cur.execute('PRAGMA cache_size=-20000')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    cur.close()
+
+if str(app.config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
+    with app.app_context():
+        event.listen(db.engine, 'connect', _sqlite_pragmas)
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -277,29 +358,32 @@ I18N: Dict[str, Dict[str, str]] = {
 
 
 def _get_lang() -> str:
-    try:
-        raw = (request.args.get('lang') or request.cookies.get('lang') or 'zh').lower()
-    except Exception:
-        raw = 'zh'
-    return raw if raw in I18N else 'zh'
+    # resolved once per request in _init_db_once_and_gate
+    return g.get('lang', 'zh')
 
 
 def t(key: str) -> str:
-    lang = _get_lang()
-    return I18N.get(lang, I18N['zh']).get(key, key)
+    # g.tmap is bound once per request in _init_db_once_and_gate
+    return g.tmap.get(key, key)
 
 
-def with_lang(url: str) -> str:
-    lang = _get_lang()
+@lru_cache(maxsize=4096)
+def _with_lang_cached(url: str, lang: str) -> str:
     sep = '&' if ('?' in url) else '?'
-    return f"{url}{sep}lang={lang}" if lang else url
+    return f"{url}{sep}lang={lang}"
+
+
+def with_lang(url: str) -> str:
+    # url_for() output repeats across renders, so the suffixed string is memoized
+    return _with_lang_cached(url, g.lang)
 
 
 # ------------------------------
 # Villas list (24)
 # ------------------------------
 
-def _load_villas() -> List[str]:
+@lru_cache(maxsize=1)
+def _load_villas() -> Tuple[str, ...]:
     raw = os.environ.get('VILLA_NAMES', '').strip()
     if raw:
         parts: List[str] = []
@@ -321,42 +405,63 @@ def _load_villas() -> List[str]:
     if len(names) < 24:
         start = len(names) + 1
         names += [f'Villa {i:02d}' for i in range(start, 25)]
-    return names
+    # immutable so it can be shared across threads; interned names compare by identity first
+    return tuple(sys.intern(n) for n in names)
 
 VILLAS = _load_villas()
 
+_OPT = Markup('<option value="{}">{}</option>')
+VILLA_OPTIONS = Markup('').join(_OPT.format(v, v) for v in VILLAS)
+
+
+def villa_options(selected: Optional[str] = None) -> Markup:
+    """Pre-rendered villa <option>s with *selected* marked by one str.replace."""
+    if not selected:
+        return VILLA_OPTIONS
+    v = str(Markup.escape(selected))
+    return Markup(str(VILLA_OPTIONS).replace(f'value="{v}">', f'value="{v}" selected>', 1))
+
 # ------------------------------
 # Models
 # ------------------------------
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    name = db.Column(db.String(80), nullable=False)
+    name = db.Column(db.String(80), nullable=False, index=True)  # login by name
     role = db.Column(db.String(20), default='staff')  # 'admin' or 'staff'
     password_hash = db.Column(db.String(255), nullable=False)
 
     def set_password(self, pw: str):
-        """Prefer PBKDF2 (werkzeug), fallback to HMAC‑SHA256 when pbkdf2 is unavailable."""
-        try:
-            self.password_hash = generate_password_hash(pw, method='pbkdf2:sha256')
-        except Exception:
-            salt = secrets.token_hex(16)
-            digest = hmac.new(salt.encode('utf-8'), pw.encode('utf-8'), hashlib.sha256).hexdigest()
-            self.password_hash = f"sha256${salt}${digest}"
+        self.password_hash = hash_password(pw)
 
     def check_password(self, pw: str) -> bool:
-        ph = self.password_hash or ''
-        if ph.startswith('sha256$'):
-            try:
-                _, salt, digest = ph.split('$', 2)
-                calc = hmac.new(salt.encode('utf-8'), pw.encode('utf-8'), hashlib.sha256).hexdigest()
-                return hmac.compare_digest(digest, calc)
-            except Exception:
-                return False
+        return verify_password(self.password_hash, pw)
+
+
+def hash_password(pw: str) -> str:
+    """Prefer PBKDF2 (werkzeug), fallback to HMAC‑SHA256 when pbkdf2 is unavailable."""
+    try:
+        return generate_password_hash(pw, method=f'pbkdf2:sha256:{PW_ITERS}')
+    except Exception:
+        salt = secrets.token_hex(16)
+        digest = hmac.new(salt.encode('utf-8'), pw.encode('utf-8'), hashlib.sha256).hexdigest()
+        return f"sha256${salt}${digest}"
+
+
+def verify_password(password_hash: Optional[str], pw: str) -> bool:
+    """Check *pw* against a stored hash without needing a hydrated User."""
+    ph = password_hash or ''
+    if ph.startswith('sha256$'):
         try:
-            return check_password_hash(ph, pw)
+            _, salt, digest = ph.split('$', 2)
+            calc = hmac.new(salt.encode('utf-8'), pw.encode('utf-8'), hashlib.sha256).hexdigest()
+            return hmac.compare_digest(digest, calc)
         except Exception:
             return False
+    try:
+        return check_password_hash(ph, pw)
+    except Exception:
+        return False
 
 
 class SOP(db.Model):
@@ -365,7 +470,7 @@ class SOP(db.Model):
     category = db.Column(db.String(80), nullable=False)
     content = db.Column(db.Text, nullable=False)
     villa = db.Column(db.String(80), nullable=True, index=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False)
 
 
 class Task(db.Model):
@@ -377,7 +482,10 @@ class Task(db.Model):
     due_date = db.Column(db.DateTime, nullable=True)
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     created_by = db.relationship('User', foreign_keys=[created_by_id])
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False)
+
+    # dashboard / list_tasks: ORDER BY created_at DESC [LIMIT 10]
+    __table_args__ = (db.Index('ix_task_created', 'created_at'),)
 
 
 class Check(db.Model):
@@ -387,16 +495,20 @@ class Check(db.Model):
     notes = db.Column(db.Text, nullable=True)
     photo_path = db.Column(db.String(255), nullable=True)
     status = db.Column(db.String(20), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     created_by = db.relationship('User', foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index('ix_check_villa_created', 'villa', 'created_at'),  # list_checks?villa=
+        db.Index('ix_check_created', 'created_at'),                 # dashboard / unfiltered list
+    )
+
 
 # ------------------------------
 # Templates (Jinja2 DictLoader)
 # ------------------------------
 BASE = """
-{% set cur_lang = request.args.get('lang') or request.cookies.get('lang') or 'zh' %}
 <!doctype html>
 <html lang="en">
 <head>
@@ -418,27 +530,19 @@ BASE = """
       <span class="navbar-toggler-icon"></span>
     </button>
     <div class="collapse navbar-collapse" id="nav">
-      <ul class="navbar-nav me-auto mb-2 mb-lg-0">
-        <li class="nav-item"><a class="nav-link" href="{{ with_lang(url_for('dashboard')) }}">{{ t('dashboard') }}</a></li>
-        <li class="nav-item"><a class="nav-link" href="{{ with_lang(url_for('list_sops')) }}">{{ t('sops') }}</a></li>
-        <li class="nav-item"><a class="nav-link" href="{{ with_lang(url_for('list_tasks')) }}">{{ t('tasks') }}</a></li>
-        <li class="nav-item"><a class="nav-link" href="{{ with_lang(url_for('list_checks')) }}">{{ t('checks') }}</a></li>
-        {% if current_user.is_authenticated and current_user.role=='admin' %}
-        <li class="nav-item"><a class="nav-link" href="{{ with_lang(url_for('admin_users')) }}">Users</a></li>
-        {% endif %}
-      </ul>
+      <ul class="navbar-nav me-auto mb-2 mb-lg-0">{{ nav_links() }}</ul>
       <form class="d-flex" method="get" action="{{ request.path }}">
         <select class="form-select" name="lang" onchange="this.form.submit()">
-          <option value="zh" {% if cur_lang=='zh' %}selected{% endif %}>中文</option>
-          <option value="ja" {% if cur_lang=='ja' %}selected{% endif %}>日本語</option>
-          <option value="en" {% if cur_lang=='en' %}selected{% endif %}>English</option>
+          <option value="zh" {% if g.lang=='zh' %}selected{% endif %}>中文</option>
+          <option value="ja" {% if g.lang=='ja' %}selected{% endif %}>日本語</option>
+          <option value="en" {% if g.lang=='en' %}selected{% endif %}>English</option>
         </select>
       </form>
       <span class="navbar-text text-light ms-3">
-        {{ t('hello') }}，{{ (current_user.name if current_user.is_authenticated else 'Guest') }}
-        {% if current_user.is_authenticated %}({{ current_user.role }}){% endif %}
+        {{ t('hello') }}，{{ user_name }}
+        {% if is_auth %}({{ current_user.role }}){% endif %}
       </span>
-      {% if current_user.is_authenticated %}
+      {% if is_auth %}
       <a class="btn btn-outline-light btn-sm ms-2" href="{{ with_lang(url_for('logout')) }}">{{ t('logout') }}</a>
       {% endif %}
     </div>
@@ -502,11 +606,7 @@ DASH = """
             <div class="col">
               <a class="btn btn-outline-secondary w-100" href="{{ with_lang(url_for('list_sops')) }}">{{ t('all_villas') }}</a>
             </div>
-            {% for v in villas %}
-            <div class="col">
-              <a class="btn btn-outline-primary w-100" href="{{ with_lang(url_for('list_sops', villa=v)) }}">{{ v }}</a>
-            </div>
-            {% endfor %}
+            {{ villa_grid }}
           </div>
         </div>
       </div>
@@ -521,7 +621,7 @@ DASH = """
             <li class="list-group-item d-flex justify-content-between align-items-center">
               <div>
                 <strong>{{ task.title }}</strong>
-                <div class="small text-muted">{{ t('status') }}: {{ t(task.status) }}{% if task.assigned_to %}|{{ t('assigned_to') }}: {{ task.assigned_to.name }}{% endif %}{% if task.due_date %}|{{ t('due_date') }}: {{ task.due_date.date() }}{% endif %}</div>
+                <div class="small text-muted">{{ t('status') }}: {{ t(task.status) }}{% if task.assignee %}|{{ t('assigned_to') }}: {{ task.assignee }}{% endif %}{% if task.due_date %}|{{ t('due_date') }}: {{ task.due_date.date() }}{% endif %}</div>
               </div>
               <div><a class="btn btn-sm btn-outline-secondary" href="{{ with_lang(url_for('edit_task', task_id=task.id)) }}">{{ t('edit') }}</a></div>
             </li>
@@ -555,7 +655,7 @@ DASH = """
       <div class="card shadow-sm mt-3">
         <div class="card-body">
           <h6 class="mb-1">{{ t('welcome_msg') }}</h6>
-          <div class="text-muted small">Lang = {{ request.args.get('lang') or request.cookies.get('lang') or 'zh' }}</div>
+          <div class="text-muted small">Lang = {{ g.lang }}</div>
         </div>
       </div>
     </div>
@@ -570,12 +670,10 @@ SOPS = """
   <h4>{{ t('sops') }}{% if villa %} — {{ villa }}{% endif %}</h4>
   <div class="d-flex gap-2">
     <form class="d-flex" method="get" action="{{ url_for('list_sops') }}">
-      <input type="hidden" name="lang" value="{{ request.args.get('lang') or request.cookies.get('lang') or 'zh' }}">
+      <input type="hidden" name="lang" value="{{ g.lang }}">
       <select class="form-select me-2" name="villa" onchange="this.form.submit()">
         <option value="">{{ t('all_villas') }}</option>
-        {% for v in villas %}
-        <option value="{{ v }}" {% if villa==v %}selected{% endif %}>{{ v }}</option>
-        {% endfor %}
+        {{ villa_options(villa) }}
       </select>
     </form>
     <a class="btn btn-primary" href="{{ with_lang(url_for('new_sop', villa=villa)) }}">+ {{ t('new_sop') }}</a>
@@ -614,9 +712,7 @@ SOP_FORM = """
     <label class="form-label">{{ t('villa') }}</label>
     <select name="villa" class="form-select">
       <option value="">—</option>
-      {% for v in villas %}
-      <option value="{{ v }}" {% if (sop and sop.villa==v) or (not sop and request.args.get('villa')==v) %}selected{% endif %}>{{ v }}</option>
-      {% endfor %}
+      {{ villa_options(sop.villa if sop else request.args.get('villa')) }}
     </select>
   </div>
   <div class="mb-3">
@@ -693,12 +789,10 @@ CHECKS = """
   <h4>{{ t('checks') }}</h4>
   <div class="d-flex gap-2">
     <form class="d-flex" method="get" action="{{ url_for('list_checks') }}">
-      <input type="hidden" name="lang" value="{{ request.args.get('lang') or request.cookies.get('lang') or 'zh' }}">
+      <input type="hidden" name="lang" value="{{ g.lang }}">
       <select class="form-select me-2" name="villa" onchange="this.form.submit()">
         <option value="">{{ t('all_villas') }}</option>
-        {% for v in villas %}
-        <option value="{{ v }}" {% if request.args.get('villa')==v %}selected{% endif %}>{{ v }}</option>
-        {% endfor %}
+        {{ villa_options(request.args.get('villa')) }}
       </select>
     </form>
     <a class="btn btn-primary" href="{{ with_lang(url_for('new_check', villa=request.args.get('villa'))) }}">+ {{ t('new_check') }}</a>
@@ -711,7 +805,7 @@ CHECKS = """
       <strong>{{ c.villa }} / {{ c.area }}</strong>
       <div class="small text-muted">{{ c.created_at.strftime('%Y-%m-%d %H:%M') }}|{{ t('status') }}: {{ t(c.status) }}</div>
       {% if c.notes %}<div class="text-muted small">{{ c.notes }}</div>{% endif %}
-      {% if c.photo_path %}<a href="{{ url_for('uploaded_file', filename=c.photo_path.split('/')[-1]) }}" target="_blank">{{ t('photo') }}</a>{% endif %}
+      {% if c.photo_path %}<a href="{{ url_for('uploaded_file', filename=c.photo_path) }}" target="_blank">{{ t('photo') }}</a>{% endif %}
     </div>
     <a class="btn btn-sm btn-outline-secondary" href="{{ with_lang(url_for('edit_check', check_id=c.id)) }}">{{ t('edit') }}</a>
   </li>
@@ -731,9 +825,7 @@ CHECK_FORM = """
     <label class="form-label">{{ t('villa') }}</label>
     <select name="villa" class="form-select" required>
       <option value="">—</option>
-      {% for v in villas %}
-      <option value="{{ v }}" {% if (check and check.villa==v) or (not check and request.args.get('villa')==v) %}selected{% endif %}>{{ v }}</option>
-      {% endfor %}
+      {{ villa_options(check.villa if check else request.args.get('villa')) }}
     </select>
   </div>
   <div class="mb-3">
@@ -748,7 +840,7 @@ CHECK_FORM = """
     <label class="form-label">{{ t('photo') }}</label>
     <input type="file" name="photo" class="form-control" accept="image/*">
     {% if check and check.photo_path %}
-      <div class="form-text"><a href="{{ url_for('uploaded_file', filename=check.photo_path.split('/')[-1]) }}" target="_blank">{{ t('photo') }}</a></div>
+      <div class="form-text"><a href="{{ url_for('uploaded_file', filename=check.photo_path) }}" target="_blank">{{ t('photo') }}</a></div>
     {% endif %}
   </div>
   <div class="mb-3">
@@ -797,7 +889,7 @@ USERS = """
 <table class="table table-striped">
   <thead><tr><th>ID</th><th>Name</th><th>Email</th><th>Role</th></tr></thead>
   <tbody>
-  {% for u in users %}
+  {% for u in users.items %}
     <tr>
       <td>{{ u.id }}</td>
       <td>{{ u.name }}</td>
@@ -807,6 +899,13 @@ USERS = """
   {% endfor %}
   </tbody>
 </table>
+{% if users.pages > 1 %}
+<nav class="d-flex gap-2">
+  {% if users.has_prev %}<a class="btn btn-outline-secondary btn-sm" href="{{ with_lang(url_for('admin_users', page=users.prev_num)) }}">&laquo;</a>{% endif %}
+  <span class="align-self-center small text-muted">{{ users.page }} / {{ users.pages }}</span>
+  {% if users.has_next %}<a class="btn btn-outline-secondary btn-sm" href="{{ with_lang(url_for('admin_users', page=users.next_num)) }}">&raquo;</a>{% endif %}
+</nav>
+{% endif %}
 {% endblock %}
 """
 
@@ -871,7 +970,9 @@ SELFTEST = """
 {% endblock %}
 """
 
-app.jinja_env.globals.update(t=t, with_lang=with_lang)
+# Templates are module constants: nothing to reload, and every compiled one stays cached.
+app.jinja_options = {**app.jinja_options, 'auto_reload': False, 'cache_size': -1}
+app.jinja_env.globals.update(t=t, with_lang=with_lang, villa_options=villa_options)
 app.jinja_loader = DictLoader({
     'BASE': BASE,
     'LOGIN': LOGIN,
@@ -888,47 +989,242 @@ app.jinja_loader = DictLoader({
     'SELFTEST': SELFTEST,
 })
 
+# Compile everything at import so no worker pays the parse cost on first render.
+for _name in app.jinja_loader.list_templates():
+    app.jinja_env.get_template(_name)
+
+# Hot list views render these directly (see fast_render).
+_T = {name: app.jinja_env.get_template(name) for name in ('DASH', 'TASKS', 'CHECKS', 'SOPS')}
+
+
+def _auth_ctx() -> dict:
+    """Unwrap current_user once so templates test plain booleans, not proxy attributes."""
+    user = current_user._get_current_object()
+    auth = user.is_authenticated
+    return {'current_user': user, 'is_auth': auth,
+            'is_admin': auth and user.role == 'admin',
+            'user_name': user.name if auth else 'Guest'}
+
+app.context_processor(_auth_ctx)
+
+
+def fast_render(name: str, **ctx) -> str:
+    """Render a pre-compiled template without Flask's per-call lookup & signals.
+    request/session/g/url_for are already Jinja globals; the auth context
+    (normally injected by the context processors) must be supplied."""
+    return _T[name].render({**_auth_ctx(), **ctx})
+
 # ------------------------------
 # Helpers
 # ------------------------------
-ALLOWED_EXT = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+ALLOWED_EXT = frozenset({'jpg', 'jpeg', 'png', 'gif', 'webp'})
 
 def allowed_file(filename: str) -> bool:
-    ext = os.path.splitext(filename.lower())[1]
-    return ext in ALLOWED_EXT
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXT
 
 
-def ensure_seed_users() -> None:
-    """Create default users once (idempotent)."""
-    def add(name: str, email: str, role: str, pw: str) -> None:
-        existing = User.query.filter((User.email == email) | (User.name == name)).first()
-        if existing is None:
-            u = User(email=email, name=name, role=role)
-            u.set_password(pw)
-            db.session.add(u)
+# endpoints whose multipart photo is spooled next to UPLOAD_FOLDER (see SPOOL_DIR)
+_PHOTO_EPS = frozenset({'new_check', 'edit_check'})
 
-    # built-ins
-    add('admin', 'admin@villa.local', 'admin', '10051005+')
-    add('Stanley', 'stanley@villa.local', 'staff', '0585')
 
+class PhotoUploadRequest(Request):
+    """Spool check photos into UPLOAD_FOLDER/.spool (as *.part) rather than a temp file
+    elsewhere, so storing the upload is a rename instead of a second full copy.
+    The spool dir is not reachable through /uploads/, so partial files are never served."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename or self.endpoint not in _PHOTO_EPS:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        part = tempfile.NamedTemporaryFile('w+b', suffix='.part', dir=SPOOL_DIR, delete=False)
+        g.setdefault('upload_parts', []).append(part.name)
+        return part
+
+app.request_class = PhotoUploadRequest
+
+
+@app.teardown_request
+def _drop_upload_parts(_exc):
+    # spooled parts that were not moved into place (rejected type, failed request)
+    for part in g.pop('upload_parts', ()):
+        try:
+            os.remove(part)
+        except FileNotFoundError:
+            pass
+
+
+def content_name(f) -> str:
+    """Content-addressed upload name: 128-bit digest + the original extension."""
+    h = blake3.blake3() if blake3 is not None else hashlib.blake2b(digest_size=16)
+    f.stream.seek(0)
+    for chunk in iter(lambda: f.stream.read(65536), b''):
+        h.update(chunk)
+    f.stream.seek(0)
+    digest = h.hexdigest(16) if blake3 is not None else h.hexdigest()
+    return f"{digest}.{secure_filename(f.filename).rpartition('.')[2].lower()}"
+
+
+def store_upload(f, dest: Path) -> None:
+    """Put an uploaded file at *dest*; a rename when it was spooled by PhotoUploadRequest.
+    *dest* is content-addressed, so an existing file already holds these bytes."""
+    if dest.exists():
+        return  # the leftover .part is removed in teardown
+    part = getattr(f.stream, 'name', None)
+    if part in g.get('upload_parts', ()):
+        f.stream.close()
+        os.replace(part, dest)
+        os.chmod(dest, 0o644)  # mkstemp-style 0600 would hide it from an X-Accel nginx
+    else:
+        # not reached from the photo endpoints (PhotoUploadRequest always spools those);
+        # kept for callers handing in an ordinary FileStorage
+        f.save(str(dest))
+
+
+def save_photo(f) -> Optional[str]:
+    """Store a check photo from the form; returns its Check.photo_path, or None if absent/rejected."""
+    if not (f and f.filename and allowed_file(f.filename)):
+        return None
+    fname = content_name(f)
+    try:
+        store_upload(f, UPLOAD_DIR / fname)
+    except Exception:
+        return None
+    return fname
+
+
+# Per-process HTML fragment caches, read on every page. Reads are plain dict lookups;
+# a miss builds and stores under the lock, so gthread threads fill each key once.
+_FRAGMENT_LOCK = threading.Lock()
+_VILLA_GRID: Dict[str, Markup] = {}
+_VILLA_BTN = Markup('<div class="col"><a class="btn btn-outline-primary w-100" href="{}">{}</a></div>')
+
+def villa_grid() -> Markup:
+    """Dashboard's per-villa SOP buttons; only the lang suffix varies, so build once per language."""
+    html = _VILLA_GRID.get(g.lang)
+    if html is None:
+        with _FRAGMENT_LOCK:
+            html = _VILLA_GRID.get(g.lang)
+            if html is None:
+                html = Markup('').join(_VILLA_BTN.format(with_lang(url_for('list_sops', villa=v)), v)
+                                       for v in VILLAS)
+                _VILLA_GRID[g.lang] = html
+    return html
+
+
+_NAV_LINKS: Dict[Tuple[str, bool], Markup] = {}
+_NAV_ITEM = Markup('<li class="nav-item"><a class="nav-link" href="{}">{}</a></li>')
+
+def nav_links() -> Markup:
+    """BASE navbar items; they only vary by language and admin-ness, so build each variant once."""
+    is_admin = current_user.is_authenticated and current_user.role == 'admin'
+    key = (g.lang, is_admin)
+    html = _NAV_LINKS.get(key)
+    if html is None:
+        with _FRAGMENT_LOCK:
+            html = _NAV_LINKS.get(key)
+            if html is None:
+                items = [('dashboard', t('dashboard')), ('list_sops', t('sops')),
+                         ('list_tasks', t('tasks')), ('list_checks', t('checks'))]
+                if is_admin:
+                    items.append(('admin_users', 'Users'))
+                html = Markup('').join(_NAV_ITEM.format(with_lang(url_for(ep)), label)
+                                       for ep, label in items)
+                _NAV_LINKS[key] = html
+    return html
+
+app.jinja_env.globals['nav_links'] = nav_links
+
+
+def parse_date(s: str) -> datetime:
+    """Parse a form date (YYYY-MM-DD). fromisoformat is the C fast path; strptime
+    only runs for looser input such as unpadded '2025-8-1'."""
+    try:
+        return datetime.fromisoformat(s)
+    except ValueError:
+        return datetime.strptime(s, '%Y-%m-%d')
+
+
+def app_url(name: str) -> str:
+    """URL of a constant endpoint (see _URLS); the cached path is app-relative, so the
+    request's SCRIPT_NAME prefix (app mounted under e.g. /memo) is added here."""
+    return request.script_root + _URLS[name]
+
+
+def redir(name: str, **q):
+    """Redirect to a constant endpoint (see _URLS) without walking the URL map."""
+    url = app_url(name)
+    if q:
+        url += '?' + urlencode(q)
+    return redirect(with_lang(url))
+
+
+def assignee_id(raw: Optional[str]) -> Optional[int]:
+    """Form value -> Task.assigned_to_id (None if blank). The FK is set as-is, without
+    loading the User; only debug runs (FLASK_DEBUG=1) check that the user exists."""
+    uid = int(raw) if raw else None
+    if _DEBUG and uid is not None:
+        assert db.session.query(User.id).filter_by(id=uid).scalar() is not None, f'unknown assignee {uid}'
+    return uid
+
+
+# (name, email, role, password)
+SEED_USERS = (
+    # built-ins
+    ('admin', 'admin@villa.local', 'admin', '10051005+'),
+    ('Stanley', 'stanley@villa.local', 'staff', '0585'),
     # extra staff seeds
-    add('ooshiro', 'ooshiro@villa.local', 'staff', '1002+')
-    add('akshay', 'akshay@villa.local', 'staff', '1003+')
-    add('mahesh', 'mahesh@villa.local', 'staff', '1004+')
-    add('shekher', 'shekher@villa.local', 'staff', '1005+')
-    add('Edrian', 'edrian@villa.local', 'staff', '1006+')
+    ('ooshiro', 'ooshiro@villa.local', 'staff', '1002+'),
+    ('akshay', 'akshay@villa.local', 'staff', '1003+'),
+    ('mahesh', 'mahesh@villa.local', 'staff', '1004+'),
+    ('shekher', 'shekher@villa.local', 'staff', '1005+'),
+    ('Edrian', 'edrian@villa.local', 'staff', '1006+'),
+)
+
+
+def ensure_seed_users() -> None:
+    """Create default users once (idempotent): one SELECT, then one multi-row INSERT."""
+    names = [s[0] for s in SEED_USERS]
+    emails = [s[1] for s in SEED_USERS]
+    taken = db.session.query(User.name, User.email).filter(
+        User.name.in_(names) | User.email.in_(emails)
+    ).all()
+    taken_names = {n for n, _ in taken}
+    taken_emails = {e for _, e in taken}
+    rows = [
+        {'name': name, 'email': email, 'role': role, 'password_hash': hash_password(pw)}
+        for name, email, role, pw in SEED_USERS
+        if name not in taken_names and email not in taken_emails
+    ]
+    if not rows:
+        return
 
-    # commit once (safe if nothing changed)
     try:
+        db.session.execute(User.__table__.insert(), rows)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         app.logger.error(f'Seed commit failed: {e}')
+
+
+def ensure_indexes() -> None:
+    """create_all() skips existing tables; add any index declared since they were created."""
+    for table in db.metadata.sorted_tables:
+        for idx in table.indexes:
+            idx.create(db.engine, checkfirst=True)
+
+
+def normalize_photo_paths() -> None:
+    """Older rows stored the absolute upload path; keep only the basename."""
+    rows = db.session.query(Check).filter(Check.photo_path.like('%/%')).all()
+    for c in rows:
+        c.photo_path = os.path.basename(c.photo_path)
+    if rows:
+        db.session.commit()
 # ------------------------------
 @login_manager.user_loader
 def load_user(user_id: str) -> Optional[User]:
     try:
-        return User.query.get(int(user_id))
+        return db.session.get(User, int(user_id))
     except Exception:
         return None
 
@@ -938,7 +1234,8 @@ from functools import wraps
 def admin_required(fn: Callable):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        if not current_user.is_authenticated or current_user.role != 'admin':
+        u = current_user._get_current_object()  # resolve the proxy once
+        if not u.is_authenticated or u.role != 'admin':
             abort(403)
         return fn(*args, **kwargs)
     return wrapper
@@ -950,37 +1247,54 @@ def admin_required(fn: Callable):
 def health():
     return 'ok', 200
 
+# endpoints reachable without the ACCESS_CODE cookie
+ACCESS_ALLOWED_EPS = frozenset({'health', 'access', 'static', 'login', 'selftest'})
+
+_DB_INIT_LOCK = threading.Lock()
+
+def init_db_once() -> None:
+    """Create schema + seed once per process; the lock stops gthread threads double-seeding."""
+    if app.config.get('_DB_INIT_DONE', False):
+        return
+    with _DB_INIT_LOCK:
+        if app.config.get('_DB_INIT_DONE', False):
+            return
+        db.create_all()
+        ensure_indexes()
+        ensure_seed_users()
+        normalize_photo_paths()
+        app.config['_DB_INIT_DONE'] = True
+
 # Defer DB init to first request to avoid boot‑time crashes on Render
 @app.before_request
 def _init_db_once_and_gate():
+    # resolve the language once; t() / with_lang() / templates read it from g
+    qlang = request.args.get('lang')
+    raw = (qlang or request.cookies.get('lang') or 'zh').lower()
+    g.lang = raw if raw in I18N else 'zh'
+    g.tmap = I18N[g.lang]
+
     # lazy DB init
     if not app.config.get('_DB_INIT_DONE', False):
         try:
-            db.create_all()
-            ensure_seed_users()
-            app.config['_DB_INIT_DONE'] = True
+            init_db_once()
         except Exception as e:
             # Don't crash; /selftest will show details
             app.logger.error(f'DB init error (deferred): {e}')
 
     # lang cookie capture
-    g.lang_to_set = None
-    lang = request.args.get('lang')
-    if lang:
-        g.lang_to_set = lang
+    g.lang_to_set = qlang or None
 
     # optional ACCESS_CODE gate
-    access_code = os.environ.get('ACCESS_CODE')
-    if access_code:
-        allowed_eps = {'health', 'access', 'static', 'login', 'selftest'}
-        ep = (request.endpoint or '').split('.')[-1]
-        has_cookie = request.cookies.get('ac') == access_code
+    if ACCESS_CODE:
+        ep = (request.endpoint or '').rpartition('.')[2]
+        has_cookie = request.cookies.get('ac') == ACCESS_CODE
         from_query = request.args.get('access')
-        if from_query and from_query == access_code:
+        if from_query and from_query == ACCESS_CODE:
             g._set_access_cookie = True
-        elif not has_cookie and ep not in allowed_eps:
+        elif not has_cookie and ep not in ACCESS_ALLOWED_EPS:
             nxt = request.full_path if request.query_string else request.path
-            return redirect(url_for('access', next=nxt))
+            return redirect(app_url('access') + '?' + urlencode({'next': nxt}))
 
 @app.after_request
 def apply_lang_cookie(response):
@@ -988,43 +1302,65 @@ def apply_lang_cookie(response):
         if getattr(g, 'lang_to_set', None):
             response.set_cookie('lang', g.lang_to_set, max_age=30*24*3600)
         if getattr(g, '_set_access_cookie', False):
-            response.set_cookie('ac', os.environ.get('ACCESS_CODE',''), max_age=7*24*3600, httponly=True)
+            response.set_cookie('ac', ACCESS_CODE or '', max_age=7*24*3600, httponly=True)
     except Exception:
         pass
     return response
 
+
+# Debug-only N+1 guard: list queries refuse lazy loads, and requests that issue
+# more than QUERY_WARN statements get logged. Keyed on FLASK_DEBUG itself: app.debug
+# is still False at import when debug is only passed to app.run() below.
+_DEBUG = os.environ.get('FLASK_DEBUG', '0') == '1'
+_LIST_GUARD = (raiseload('*'),) if _DEBUG else ()
+QUERY_WARN = int(os.environ.get('QUERY_WARN', '5'))
+
+def _count_query(_conn, _cursor, _statement, _params, _context, _executemany) -> None:
+    # the deferred DDL/seed statements are not the request's own
+    if has_request_context() and app.config.get('_DB_INIT_DONE'):
+        g.query_count = g.get('query_count', 0) + 1
+
+if _DEBUG:
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _count_query)
+
+    @app.after_request
+    def warn_query_count(response):
+        n = g.get('query_count', 0)
+        if n > QUERY_WARN:
+            app.logger.warning(f'{request.method} {request.path}: {n} SQL statements')
+        return response
+
 # ------------------------------
 # Routes
 # ------------------------------
 @app.route('/')
 def index():
-    return redirect(with_lang(url_for('dashboard')))
+    return redir('dashboard')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         ident = (request.form.get('identifier') or '').strip()
         pw = request.form.get('password') or ''
-        if '@' in ident:
-            user = User.query.filter_by(email=ident).first()
-        else:
-            user = User.query.filter_by(name=ident).first()
-        if user and user.check_password(pw):
-            login_user(user)
-            nxt = request.args.get('next') or url_for('dashboard')
+        # fetch only what the password check needs; hydrate a User on success only
+        col = User.email if '@' in ident else User.name
+        row = db.session.query(User.id, User.password_hash).filter(col == ident).limit(1).one_or_none()
+        if row and verify_password(row.password_hash, pw):
+            login_user(db.session.get(User, row.id))
+            nxt = request.args.get('next') or app_url('dashboard')
             return redirect(with_lang(nxt))
         flash('Invalid credentials', 'warning')
     return render_template('LOGIN')
 
 @app.route('/access', methods=['GET','POST'])
 def access():
-    access_code = os.environ.get('ACCESS_CODE')
-    if not access_code:
-        return redirect(with_lang(url_for('dashboard')))
+    if not ACCESS_CODE:
+        return redir('dashboard')
     if request.method == 'POST':
-        if request.form.get('access') == access_code:
+        if request.form.get('access') == ACCESS_CODE:
             g._set_access_cookie = True
-            nxt = request.args.get('next') or url_for('dashboard')
+            nxt = request.args.get('next') or app_url('dashboard')
             return redirect(with_lang(nxt))
         else:
             flash(t('access_denied'), 'warning')
@@ -1036,14 +1372,20 @@ def logout():
         logout_user()
     except Exception:
         pass
-    return redirect(with_lang(url_for('login')))
+    return redir('login')
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    tasks = Task.query.order_by(Task.created_at.desc()).limit(10).all()
-    checks = Check.query.order_by(Check.created_at.desc()).limit(10).all()
-    return render_template('DASH', tasks=tasks, checks=checks, villas=VILLAS)
+    # read-only widgets: plain rows with just the rendered columns, no ORM objects
+    tasks = db.session.execute(
+        db.select(Task.id, Task.title, Task.status, Task.due_date, User.name.label('assignee'))
+        .outerjoin(User, Task.assigned_to_id == User.id)
+        .order_by(Task.created_at.desc(), Task.id.desc()).limit(10)).all()
+    checks = db.session.execute(
+        db.select(Check.id, Check.villa, Check.area, Check.status, Check.created_at)
+        .order_by(Check.created_at.desc(), Check.id.desc()).limit(10)).all()
+    return fast_render('DASH', tasks=tasks, checks=checks, villa_grid=villa_grid())
 
 # ---- SOPS ----
 @app.route('/sops')
@@ -1053,8 +1395,8 @@ def list_sops():
     q = SOP.query
     if villa:
         q = q.filter_by(villa=villa)
-    sops = q.order_by(SOP.created_at.desc()).all()
-    return render_template('SOPS', sops=sops, villa=villa, villas=VILLAS)
+    sops = q.order_by(SOP.created_at.desc(), SOP.id.desc()).all()
+    return fast_render('SOPS', sops=sops, villa=villa)
 
 @app.route('/sops/new', methods=['GET','POST'])
 @login_required
@@ -1068,28 +1410,28 @@ def new_sop():
         )
         db.session.add(s)
         db.session.commit()
-        return redirect(with_lang(url_for('list_sops', villa=s.villa or '')))
-    return render_template('SOP_FORM', sop=None, villas=VILLAS)
+        return redir('list_sops', villa=s.villa or '')
+    return render_template('SOP_FORM', sop=None)
 
 @app.route('/sops/<int:sop_id>/edit', methods=['GET','POST'])
 @login_required
 def edit_sop(sop_id):
-    sop = SOP.query.get_or_404(sop_id)
+    sop = db.get_or_404(SOP, sop_id)
     if request.method == 'POST':
         sop.title = request.form['title']
         sop.category = request.form['category']
         sop.content = request.form['content']
         sop.villa = request.form.get('villa') or None
         db.session.commit()
-        return redirect(with_lang(url_for('list_sops', villa=sop.villa or '')))
-    return render_template('SOP_FORM', sop=sop, villas=VILLAS)
+        return redir('list_sops', villa=sop.villa or '')
+    return render_template('SOP_FORM', sop=sop)
 
 # ---- Tasks ----
 @app.route('/tasks')
 @login_required
 def list_tasks():
-    tasks = Task.query.order_by(Task.created_at.desc()).all()
-    return render_template('TASKS', tasks=tasks)
+    tasks = db.session.query(Task).options(joinedload(Task.assigned_to), *_LIST_GUARD).order_by(Task.created_at.desc(), Task.id.desc()).all()
+    return fast_render('TASKS', tasks=tasks)
 
 @app.route('/tasks/new', methods=['GET','POST'])
 @login_required
@@ -1097,38 +1439,36 @@ def new_task():
     if request.method == 'POST':
         title = request.form['title']
         status = request.form.get('status','pending')
-        assigned_to_id = request.form.get('assigned_to') or None
         due_date = request.form.get('due_date') or None
-        assigned_user = User.query.get(int(assigned_to_id)) if assigned_to_id else None
-        task = Task(title=title, status=status, assigned_to=assigned_user, created_by=current_user)
+        task = Task(title=title, status=status, assigned_to_id=assignee_id(request.form.get('assigned_to')),
+                    created_by=current_user)
         if due_date:
             try:
-                task.due_date = datetime.strptime(due_date, '%Y-%m-%d')
+                task.due_date = parse_date(due_date)
             except Exception:
                 pass
         db.session.add(task)
         db.session.commit()
-        return redirect(with_lang(url_for('list_tasks')))
+        return redir('list_tasks')
     users = User.query.order_by(User.name.asc()).all()
     return render_template('TASK_FORM', task=None, users=users)
 
 @app.route('/tasks/<int:task_id>/edit', methods=['GET','POST'])
 @login_required
 def edit_task(task_id):
-    task = Task.query.get_or_404(task_id)
+    task = db.get_or_404(Task, task_id)
     if request.method == 'POST':
         task.title = request.form['title']
         task.status = request.form.get('status','pending')
-        assigned_to_id = request.form.get('assigned_to') or None
         due_date = request.form.get('due_date') or None
-        task.assigned_to = User.query.get(int(assigned_to_id)) if assigned_to_id else None
+        task.assigned_to_id = assignee_id(request.form.get('assigned_to'))
         if due_date:
             try:
-                task.due_date = datetime.strptime(due_date, '%Y-%m-%d')
+                task.due_date = parse_date(due_date)
             except Exception:
                 pass
         db.session.commit()
-        return redirect(with_lang(url_for('list_tasks')))
+        return redir('list_tasks')
     users = User.query.order_by(User.name.asc()).all()
     return render_template('TASK_FORM', task=task, users=users)
 
@@ -1137,11 +1477,11 @@ def edit_task(task_id):
 @login_required
 def list_checks():
     villa = request.args.get('villa') or None
-    q = Check.query
+    q = db.session.query(Check).options(*_LIST_GUARD)
     if villa:
         q = q.filter_by(villa=villa)
-    checks = q.order_by(Check.created_at.desc()).all()
-    return render_template('CHECKS', checks=checks, villas=VILLAS)
+    checks = q.order_by(Check.created_at.desc(), Check.id.desc()).all()
+    return fast_render('CHECKS', checks=checks)
 
 @app.route('/checks/new', methods=['GET','POST'])
 @login_required
@@ -1151,57 +1491,51 @@ def new_check():
         area = request.form['area']
         notes = request.form.get('notes') or ''
         status = request.form.get('status','pending')
-        photo = request.files.get('photo')
-        photo_path = None
-        if photo and allowed_file(photo.filename):
-            fname = datetime.utcnow().strftime('%Y%m%d%H%M%S_') + secure_filename(photo.filename)
-            dest = Path(app.config['UPLOAD_FOLDER']) / fname
-            try:
-                photo.save(str(dest))
-                photo_path = str(dest)
-            except Exception:
-                photo_path = None
+        photo_path = save_photo(request.files.get('photo'))
         c = Check(villa=villa, area=area, notes=notes, status=status, photo_path=photo_path, created_by=current_user)
         db.session.add(c)
         db.session.commit()
-        return redirect(with_lang(url_for('list_checks', villa=villa)))
-    return render_template('CHECK_FORM', check=None, villas=VILLAS)
+        return redir('list_checks', villa=villa)
+    return render_template('CHECK_FORM', check=None)
 
 @app.route('/checks/<int:check_id>/edit', methods=['GET','POST'])
 @login_required
 def edit_check(check_id):
-    check = Check.query.get_or_404(check_id)
+    check = db.get_or_404(Check, check_id)
     if request.method == 'POST':
         check.villa = request.form['villa']
         check.area = request.form['area']
         check.notes = request.form.get('notes') or ''
         check.status = request.form.get('status','pending')
-        photo = request.files.get('photo')
-        if photo and allowed_file(photo.filename):
-            fname = datetime.utcnow().strftime('%Y%m%d%H%M%S_') + secure_filename(photo.filename)
-            dest = Path(app.config['UPLOAD_FOLDER']) / fname
-            try:
-                photo.save(str(dest))
-                check.photo_path = str(dest)
-            except Exception:
-                pass
+        check.photo_path = save_photo(request.files.get('photo')) or check.photo_path
         db.session.commit()
-        return redirect(with_lang(url_for('list_checks', villa=check.villa)))
-    return render_template('CHECK_FORM', check=check, villas=VILLAS)
+        return redir('list_checks', villa=check.villa)
+    return render_template('CHECK_FORM', check=check)
 
 # ---- Files ----
 @app.route('/uploads/<path:filename>')
 @login_required
 def uploaded_file(filename):
     safe = secure_filename(filename)
-    return send_from_directory(app.config['UPLOAD_FOLDER'], safe)
+    if app.config.get('USE_XACCEL'):
+        r = app.response_class()
+        r.headers['X-Accel-Redirect'] = f'/protected-uploads/{safe}'
+        return r
+    r = send_from_directory(UPLOAD_DIR, safe, max_age=86400, conditional=True, etag=True)
+    # Names are content hashes (older ones timestamp-prefixed) and never rewritten,
+    # so the bytes behind a URL don't change. Keep it private: photos sit behind login.
+    r.cache_control.public = False
+    r.cache_control.private = True
+    r.cache_control.immutable = True
+    return r
 
 # ---- Admin Users ----
 @app.route('/admin/users')
 @login_required
 @admin_required
 def admin_users():
-    users = User.query.order_by(User.id.asc()).all()
+    # ordered by the primary key, so LIMIT/OFFSET walks the rowid b-tree without a sort
+    users = db.paginate(db.select(User).order_by(User.id.asc()), per_page=50, error_out=False)
     return render_template('USERS', users=users)
 
 @app.route('/admin/users/new', methods=['GET','POST'])
@@ -1231,25 +1565,48 @@ def selftest():
     results: List[TestResult] | None = None
     if request.method == 'POST':
         results = []
+        # templates were compiled at import; render each with an empty context so
+        # template errors (bad attribute/filter use, broken blocks) actually surface
+        failed = []
+        for name, ctx in (('DASH', {'tasks': (), 'checks': (), 'villa_grid': villa_grid()}),
+                          ('TASK_FORM', {'task': None, 'users': ()}),
+                          ('CHECK_FORM', {'check': None}),
+                          ('SOP_FORM', {'sop': None})):
+            try:
+                render_template(name, **ctx)
+            except Exception as e:
+                failed.append(f'{name}: {e}')
+        results.append(TestResult('Render templates' + (': ' + '; '.join(failed) if failed else ''),
+                                  not failed))
         try:
-            _ = render_template('LOGIN')
-            results.append(TestResult('Render templates', True))
-        except Exception as e:
-            results.append(TestResult(f'Render templates: {e}', False))
-        try:
-            db.create_all()
-            ensure_seed_users()
+            init_db_once()
             results.append(TestResult('DB create_all + seed', True))
         except Exception as e:
             results.append(TestResult(f'DB init: {e}', False))
         try:
-            cnt = User.query.count()
+            cnt = db.session.query(User).count()
             results.append(TestResult(f'User count = {cnt}', True))
         except Exception as e:
             results.append(TestResult(f'DB query users: {e}', False))
+        try:
+            # write probe in a SAVEPOINT that is rolled back: no commit, nothing synced to disk
+            sp = db.session.begin_nested()
+            res = db.session.execute(db.insert(Task).values(title='__selftest__', status='pending'))
+            ok = res.rowcount == 1
+            sp.rollback()
+            results.append(TestResult('DB write (rolled back)', ok))
+        except Exception as e:
+            db.session.rollback()
+            results.append(TestResult(f'DB write: {e}', False))
     return render_template('SELFTEST', results=results)
 
+# Constant redirect targets, built once against the finished URL map. The paths are
+# app-relative (no request, so no SCRIPT_NAME): use them via app_url()/redir() only.
+_url_adapter = app.url_map.bind('')
+_URLS = {ep: _url_adapter.build(ep) for ep in ('dashboard', 'login', 'access',
+                                               'list_sops', 'list_tasks', 'list_checks')}
+
 # ---- Main ----
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
-    app.run(host='0.0.0.0', port=port, debug=(os.environ.get('FLASK_DEBUG','0')=='1'))
+    app.run(host='0.0.0.0', port=port, debug=_DEBUG)